@@ -1,4 +1,5 @@
 #!/usr/bin/python
+import re
 
 
 def replace_title(doc: str):
@@ -16,23 +17,26 @@ def include_toctree(doc):
     return doc + "\n\n.. include:: index_toctree.rst\n"
 
 
-def add_links_to_doc(doc):
-    doc = doc.replace("``Throttle.loop()``",
-                      ":func:`Throttle.loop() <throttle.Throttle.loop>`")
-
-    doc = doc.replace("``Throttle.aloop()``",
-                      ":func:`Throttle.aloop() <throttle.Throttle.aloop>`")
+LINKS = {
+    "``Throttle.loop()``":
+        ":func:`Throttle.loop() <throttle.Throttle.loop>`",
+    "``Throttle.aloop()``":
+        ":func:`Throttle.aloop() <throttle.Throttle.aloop>`",
+    "``throttle.throttle()``":
+        ":func:`~throttle.throttle`",
+    "``throttle.athrottle()``":
+        ":func:`~throttle.athrottle`",
+    "``throttle.install_fast_loop()``":
+        ":func:`~throttle.install_fast_loop`",
+    "``RateMeter``":
+        ":class:`~rate_meter.RateMeter`",
+}
 
-    doc = doc.replace("``throttle.throttle()``",
-                      ":func:`~throttle.throttle`")
+LINKS_PATTERN = re.compile("|".join(re.escape(key) for key in LINKS))
 
-    doc = doc.replace("``throttle.athrottle()``",
-                      ":func:`~throttle.athrottle`")
 
-    doc = doc.replace("``RateMeter``",
-                      ":class:`~rate_meter.RateMeter`")
-
-    return doc
+def add_links_to_doc(doc):
+    return LINKS_PATTERN.sub(lambda match: LINKS[match.group(0)], doc)
 
 
 def main():
@@ -1,7 +1,12 @@
-from bisect import bisect_left
-from collections import deque
+from array import array
 from time import perf_counter
 
+try:
+    from time import perf_counter_ns
+except ImportError:  # Python < 3.7
+    def perf_counter_ns():
+        return int(perf_counter() * 1e9)
+
 
 class RateMeter:
     """
@@ -10,65 +15,155 @@ class RateMeter:
     seconds, so the measure can calculate the measured rate in real time.
     """
 
-    def __init__(self, interval=1.0):
+    __slots__ = ('_interval', '_interval_ns', '_max_samples', '_capacity',
+                 '_times', '_iters', '_head', '_size', '_rate', '__weakref__')
+
+    def __init__(self, interval=1.0, capacity=64, max_samples=None):
         """
         Returns a :class:`RateMeter` instance.
 
         :param interval: Interval value for rate measurement, in seconds.
                          Rate will be calculated over the last `interval`
                          seconds.
+        :param capacity: Initial number of samples the internal circular
+                         buffer can hold. It is rounded up to a power of
+                         two and doubled whenever the buffer gets full.
+        :param max_samples: Maximum number of samples to store. If set,
+                            the buffer stops growing and the oldest sample
+                            is discarded on every update once this number
+                            is reached, so the rate may be calculated over
+                            less than `interval` seconds. If not set, the
+                            number of samples is unbounded.
         """
-        self._times = deque()
-        self._iters = deque()
         self.interval = interval
+        self.max_samples = max_samples
+        self._capacity = 1 << max(capacity - 1, 0).bit_length()
+        self._times = array('q', [0]) * self._capacity
+        # Iteration numbers may be any number (even floats or integers
+        # above 64 bits), so they are kept in a list
+        self._iters = [0] * self._capacity
+        self._head = 0
+        self._size = 0
+        self._rate = 0
 
-    def restart(self):
+    @property
+    def interval(self):
         """
-        Restarts this :class:`RateMeter` instance, removing all stored data.
+        Interval value for rate measurement, in seconds. Time references
+        are internally kept as integer nanoseconds, so the interval is
+        rounded to the nearest nanosecond.
+        """
+        return self._interval
+
+    @interval.setter
+    def interval(self, value):
+        self._interval = value
+        self._interval_ns = round(value * 1e9)
+
+    @property
+    def max_samples(self):
+        """
+        Maximum number of samples to store, or None if unbounded. It must
+        be at least 2. If lowered, the samples over the limit are discarded
+        on the next :func:`update`.
         """
-        self._times.clear()
-        self._iters.clear()
+        return self._max_samples
 
-    def _remove_past_items(self):
+    @max_samples.setter
+    def max_samples(self, value):
+        if value is not None and value < 2:
+            raise ValueError("max_samples must be at least 2")
+        self._max_samples = value
+
+    def __len__(self):
         """
-        Internal function. Removes all data stored before `interval` seconds.
+        Returns the number of samples currently stored.
         """
-        first_time_value = self._times[-1] - self.interval
-        first_time_index = bisect_left(self._times, first_time_value)
+        return self._size
 
-        # Time difference between last and first items must remain
-        # equal or greater than 'interval'
-        if self._times.count(first_time_value) == 0:
-            first_time_index -= 1
+    def restart(self):
+        """
+        Restarts this :class:`RateMeter` instance, removing all stored data.
+        """
+        self._head = 0
+        self._size = 0
+        self._rate = 0
 
-        for _ in range(first_time_index):
-            self._times.popleft()
-            self._iters.popleft()
+    def _grow(self):
+        """
+        Internal function. Doubles the capacity of the circular buffer,
+        moving the stored samples to the beginning of the new buffers.
+        """
+        head = self._head
+        self._times = (self._times[head:] + self._times[:head] +
+                       array('q', [0]) * self._capacity)
+        self._iters = (self._iters[head:] + self._iters[:head] +
+                       [0] * self._capacity)
+        self._capacity *= 2
+        self._head = 0
 
-    def update(self, iter_num=None):
+    def update(self, iter_num=None, _pc=perf_counter_ns):
         """
-        Add a time reference for a new code iteration.
+        Add a time reference for a new code iteration. Data stored before
+        the last `interval` seconds is removed.
 
-        :param iter_num: Current iteration number. If not set, the
-                         previous iteration count value increased by 1
-                         will be taken.
+        :param iter_num: Current iteration number. If not set, the previous
+                         iteration count value increased by 1 will be
+                         taken.
         """
+        max_samples = self._max_samples
+        if max_samples is not None and self._size >= max_samples:
+            # The oldest samples are discarded, like in a full deque with
+            # 'maxlen'. More than one may go if max_samples was lowered
+            drop = self._size - max_samples + 1
+            self._head = (self._head + drop) & (self._capacity - 1)
+            self._size -= drop
+        elif self._size == self._capacity:
+            self._grow()
+        times = self._times
+        iters = self._iters
+        mask = self._capacity - 1
+        head = self._head
+        size = self._size
+        tail = (head + size) & mask
+
         if iter_num is None:
-            iter_num = self._iters[-1] + 1 if len(self._iters) > 0 else 0
-        t_current = perf_counter()
-        self._times.append(t_current)
-        self._iters.append(iter_num)
-        self._remove_past_items()
+            iter_num = iters[(tail - 1) & mask] + 1 if size else 0
+        t_current = _pc()
+        times[tail] = t_current
+        iters[tail] = iter_num
+        size += 1
+        first_time_value = t_current - self._interval_ns
+
+        if size > 2 and times[(tail - 1) & mask] <= first_time_value:
+            # The previous item has already expired (e.g. after a long
+            # pause), so all the older ones are dropped at once
+            head = (tail - 1) & mask
+            size = 2
+        else:
+            # Time difference between last and first items must remain
+            # equal or greater than 'interval', so the newest item stored
+            # at or before 'first_time_value' is kept
+            while size > 1 and times[(head + 1) & mask] <= first_time_value:
+                head = (head + 1) & mask
+                size -= 1
+
+        self._head = head
+        self._size = size
+
+        # The rate is only calculated here, so rate() is a simple read
+        if head == tail:
+            self._rate = 0
+        else:
+            time_diff = t_current - times[head]
+            self._rate = (0 if time_diff == 0
+                          else (iter_num - iters[head]) * 1e9 / time_diff)
 
     def rate(self):
         """
-        Calculates the rate over the last `interval` seconds.
+        Returns the rate over the last `interval` seconds. The value is
+        calculated on every call to :func:`update`.
 
         :return: Measured rate, or 0 if there is no data.
         """
-        if len(self._times) <= 1:
-            return 0
-
-        value_diff = self._iters[-1] - self._iters[0]
-        time_diff = self._times[-1] - self._times[0]
-        return 0 if time_diff == 0 else value_diff / time_diff
+        return self._rate
@@ -0,0 +1,25 @@
+import pytest
+import uvloop
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_asyncio_loop_factories():
+    """
+    Runs the asynchronous tests on uvloop event loops.
+    """
+    return {"uvloop": uvloop.new_event_loop}
+
+
+try:
+    from pytest_asyncio.plugin import PytestAsyncioSpecs  # noqa: F401
+except ImportError:
+    # Older pytest-asyncio versions without loop factories (like the one
+    # locked in Pipfile.lock) take the loop from the event_loop fixture
+    @pytest.fixture
+    def event_loop():
+        """
+        Yields a uvloop event loop for each asynchronous test.
+        """
+        loop = uvloop.new_event_loop()
+        yield loop
+        loop.close()
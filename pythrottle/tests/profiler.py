@@ -1,12 +1,17 @@
+import gc
 import time
 
 
 class Profiler:
     """
     This class can be used as a context manager to time a block of code and
-    calculate some metrics.
+    calculate some metrics. The garbage collector is disabled inside the
+    block, so its pauses are not included in the measurements.
     """
 
+    __slots__ = ('t_start', 't_end', 'iter_count', 'target_rate',
+                 '_gc_enabled')
+
     def __init__(self, iter_count=0, target_rate=None):
         self.t_start = 0.0
         self.t_end = 0.0
@@ -29,8 +34,12 @@ class Profiler:
         return 1 - self.elapsed / target_elapsed
 
     def __enter__(self):
+        self._gc_enabled = gc.isenabled()
+        gc.disable()
         self.t_start = time.perf_counter()
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
         self.t_end = time.perf_counter()
+        if self._gc_enabled:
+            gc.enable()
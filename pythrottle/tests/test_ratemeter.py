@@ -1,3 +1,6 @@
+import time
+import weakref
+
 import pytest
 
 from pythrottle.rate_meter import RateMeter
@@ -29,8 +32,7 @@ def assert_results(rate_meter, values):
 
     rate_meter.restart()
     assert rate_meter.rate() == 0
-    assert len(rate_meter._iters) == 0
-    assert len(rate_meter._times) == 0
+    assert len(rate_meter) == 0
 
 
 def test_ratemeter_non_consecutive_update(throttle, rate_meter):
@@ -70,3 +72,88 @@ def test_ratemeter_default_update_param(throttle, rate_meter):
             values.append(measured_rate)
 
     assert_results(rate_meter, values)
+
+
+def test_ratemeter_buffer_growth():
+    """
+    Tests that the circular buffer of a :class:`RateMeter` grows when it
+    gets full, keeping the stored samples in order.
+    """
+    rate_meter = RateMeter(interval=INTERVAL, capacity=4)
+
+    for i in range(10):
+        rate_meter.update(2 * i)
+
+    assert len(rate_meter) == 10
+    assert rate_meter._capacity == 16
+    assert rate_meter.rate() > 0
+    assert rate_meter._iters[rate_meter._head] == 0
+
+    rate_meter.restart()
+    assert rate_meter.rate() == 0
+    assert len(rate_meter) == 0
+
+
+def test_ratemeter_iter_types():
+    """
+    Tests that a :class:`RateMeter` accepts float iteration numbers and
+    integers that do not fit in 64 bits.
+    """
+    for start in (0.5, 2 ** 64):
+        rate_meter = RateMeter(interval=INTERVAL, capacity=2)
+        for i in range(5):
+            rate_meter.update(start + i)
+            time.sleep(0.001)
+        assert rate_meter.rate() > 0
+
+
+def test_ratemeter_eviction_after_pause():
+    """
+    Tests that all the expired samples are dropped at once when a
+    :class:`RateMeter` is updated after a pause longer than its interval.
+    """
+    rate_meter = RateMeter(interval=0.1)
+
+    for i in range(50):
+        rate_meter.update(i)
+    time.sleep(0.2)
+    rate_meter.update(50)
+
+    assert len(rate_meter) == 2
+    assert 0 < rate_meter.rate() < 1 / 0.2
+
+
+def test_ratemeter_max_samples():
+    """
+    Tests that a :class:`RateMeter` with `max_samples` discards the oldest
+    samples instead of growing its buffer.
+    """
+    rate_meter = RateMeter(interval=INTERVAL, capacity=2, max_samples=5)
+
+    for i in range(20):
+        rate_meter.update(i)
+
+    assert len(rate_meter) == 5
+    assert rate_meter._capacity == 8
+    assert rate_meter._iters[rate_meter._head] == 15
+    assert rate_meter.rate() > 0
+
+    # Lowering the limit drops the extra samples on the next update
+    rate_meter.max_samples = 3
+    rate_meter.update(20)
+    assert len(rate_meter) == 3
+    assert rate_meter._iters[rate_meter._head] == 18
+
+    with pytest.raises(ValueError):
+        RateMeter(max_samples=1)
+    with pytest.raises(ValueError):
+        rate_meter.max_samples = 1
+    assert rate_meter.max_samples == 3
+
+
+def test_ratemeter_weakref():
+    """
+    Tests that :class:`RateMeter` instances can be weakly referenced.
+    """
+    rate_meter = RateMeter()
+    assert weakref.ref(rate_meter)() is rate_meter
@@ -1,17 +1,23 @@
 import asyncio
+import functools
 import os
+import threading
 import time
+import weakref
 
 import pytest
-import uvloop
 
-from pythrottle.throttle import Throttle, throttle, athrottle
+import pythrottle.throttle as throttle_module
+from pythrottle.throttle import Throttle, throttle, athrottle, precise_sleep
+from pythrottle.throttle import _probe_sleep_resolution, _CallLimiters
 from pythrottle.tests.profiler import Profiler
 
-uvloop.install()
 RATE = 10000
 MAX_ERROR = float(os.getenv("THROTTLE_TEST_MAX_ERROR", "0.03")) / 100
-TESTS_DURATION = 10
+# Short by default for local runs, CI sets a longer duration
+TESTS_DURATION = float(os.getenv("THROTTLE_TEST_DURATION", "2"))
+INTERVAL = 1 / RATE
+ITER_COUNT = round(TESTS_DURATION * RATE)
 
 
 def current_test_name():
@@ -28,7 +34,7 @@ def throttle_fxt():
     """
     Yields a :class:`Throttle` instance with the default rate.
     """
-    yield Throttle(interval=(1 / RATE))
+    yield Throttle(interval=INTERVAL)
 
 
 @pytest.fixture(name="profiler")
@@ -37,8 +43,26 @@ def profiler_fxt():
     Yields a :class:`Profiler` instance with the default rate and number of
     iterations.
     """
-    iter_count = TESTS_DURATION * RATE
-    yield Profiler(iter_count, target_rate=RATE)
+    yield Profiler(ITER_COUNT, target_rate=RATE)
+
+
+@pytest.fixture(name="fake_clock")
+def fake_clock_fxt(monkeypatch):
+    """
+    Replaces the clock read by :func:`Throttle.elapsed` with a fake one
+    that only moves when the test advances it, so decorator tests do not
+    depend on real sleeps. Yields a function to advance the clock by a
+    number of seconds.
+    """
+    now = [0]
+
+    def advance(seconds):
+        now[0] += round(seconds * 1e9)
+
+    monkeypatch.setattr(Throttle, "elapsed",
+                        functools.partialmethod(Throttle.elapsed,
+                                                _pc=lambda: now[0]))
+    yield advance
 
 
 def log_results(measured_rate, error):
@@ -69,10 +93,11 @@ def test_sync_elapsed_exact(throttle_obj, profiler):
     to wait between intervals with `exact` parameter equals to True.
     """
     with profiler:
-        sleep_time = (0.01 / RATE) if (0.01 / RATE) < 0.001 else 0.001
+        assert not throttle_obj.elapsed(exact=True)
         for _ in range(profiler.iter_count):
-            while not throttle_obj.elapsed(exact=True):
-                time.sleep(sleep_time)
+            t_target = throttle_obj._t_start + throttle_obj._interval_ns
+            precise_sleep(t_target / 1e9)
+            assert throttle_obj.elapsed(exact=True)
 
     assert_profiler_results(profiler, throttle_obj)
 
@@ -86,7 +111,7 @@ def test_sync_elapsed_inexact():
     simulated_rate = 4
     max_error = 0.01
     throttle_obj = Throttle(interval=(1 / rate))
-    iter_count = TESTS_DURATION * rate
+    iter_count = round(TESTS_DURATION * rate)
 
     with Profiler(iter_count, target_rate=simulated_rate) as profiler:
         for _ in range(iter_count):
@@ -96,6 +121,143 @@ def test_sync_elapsed_inexact():
     assert_profiler_results(profiler, throttle_obj, max_error)
 
 
+def test_sync_elapsed_many():
+    """
+    Tests that :func:`Throttle.elapsed_many` counts all the intervals
+    elapsed during a pause at once.
+    """
+    throttle_obj = Throttle(interval=0.01)
+    assert throttle_obj.elapsed_many() == 0
+    t_start = throttle_obj._t_start
+
+    precise_sleep((t_start + 5.5 * throttle_obj._interval_ns) / 1e9)
+    assert throttle_obj.elapsed_many(auto_reset=False) == 5
+    assert throttle_obj.ticks == 0
+    assert throttle_obj.elapsed_many() == 5
+    assert throttle_obj.ticks == 5
+    assert throttle_obj._t_start == t_start + 5 * throttle_obj._interval_ns
+    assert throttle_obj.elapsed_many() == 0
+
+
+def test_t_start():
+    """
+    Tests that :attr:`Throttle.t_start` reads and sets the time reference
+    in seconds.
+    """
+    throttle_obj = Throttle(interval=0.01)
+    assert throttle_obj.t_start is None
+
+    throttle_obj.elapsed()
+    assert throttle_obj.t_start == throttle_obj._t_start / 1e9
+
+    throttle_obj.t_start = 1.5
+    assert throttle_obj._t_start == 1500000000
+    assert throttle_obj.t_start == 1.5
+
+    throttle_obj.t_start = None
+    assert throttle_obj._t_start is None
+
+    # Setting the time reference again restarts the tick count
+    throttle_obj.ticks = 3
+    throttle_obj.elapsed()
+    assert throttle_obj.ticks == 0
+    throttle_obj.ticks = 3
+    throttle_obj.t_start = None
+    throttle_obj.wait_next()
+    assert throttle_obj.ticks == 1
+
+
+def test_weakref():
+    """
+    Tests that :class:`Throttle` instances can be weakly referenced.
+    """
+    throttle_obj = Throttle(interval=0.01)
+    assert weakref.ref(throttle_obj)() is throttle_obj
+
+
+def test_precise_sleep():
+    """
+    Tests that :func:`precise_sleep` returns at the given deadline, both
+    sleeping and busy-waiting the whole time.
+    """
+    for spin_threshold in (0.0, 0.01):
+        with Profiler() as profiler:
+            precise_sleep(time.perf_counter() + 0.1, spin_threshold)
+        assert abs(profiler.elapsed_error(0.1)) < 0.01
+
+    with Profiler() as profiler:
+        precise_sleep(time.perf_counter() - 1)
+    assert profiler.elapsed < 0.001
+
+
+def test_spin_threshold_lazy_probe(monkeypatch):
+    """
+    Tests that :data:`SPIN_THRESHOLD` is only measured when the first wait
+    needs it.
+    """
+    probes = []
+
+    def probe():
+        probes.append(None)
+        return 0.002
+
+    monkeypatch.setattr(throttle_module, "SPIN_THRESHOLD", None)
+    monkeypatch.setattr(throttle_module, "_probe_sleep_resolution", probe)
+
+    throttle_obj = Throttle(interval=0.01)
+    assert throttle_obj.spin_threshold is None
+    assert not probes
+
+    throttle_obj.wait_next()
+    throttle_obj.wait_next()
+    assert throttle_module.SPIN_THRESHOLD == 0.002
+    assert len(probes) == 1
+
+
+def test_spin_threshold_probe_deadline(monkeypatch):
+    """
+    Tests that the time spent measuring :data:`SPIN_THRESHOLD` does not
+    delay the first wait beyond its deadline.
+    """
+    def probe():
+        time.sleep(0.05)
+        return 0.002
+
+    monkeypatch.setattr(throttle_module, "SPIN_THRESHOLD", None)
+    monkeypatch.setattr(throttle_module, "_probe_sleep_resolution", probe)
+
+    with Profiler() as profiler:
+        precise_sleep(time.perf_counter() + 0.1)
+    assert abs(profiler.elapsed_error(0.1)) < 0.01
+
+
+@pytest.mark.asyncio
+async def test_spin_threshold_async_no_probe(monkeypatch):
+    """
+    Tests that asynchronous waits do not block the event loop measuring
+    :data:`SPIN_THRESHOLD`.
+    """
+    def probe():
+        raise AssertionError("SPIN_THRESHOLD measured in the event loop")
+
+    monkeypatch.setattr(throttle_module, "SPIN_THRESHOLD", None)
+    monkeypatch.setattr(throttle_module, "_probe_sleep_resolution", probe)
+
+    throttle_obj = Throttle(interval=0.01)
+    await throttle_obj.await_next()
+    await throttle_obj.await_next()
+    assert throttle_module.SPIN_THRESHOLD is None
+
+
+def test_probe_sleep_resolution():
+    """
+    Tests that the measured oversleep of :func:`time.sleep` is a
+    non-negative value below the sleep time.
+    """
+    resolution = _probe_sleep_resolution(samples=5)
+    assert 0 <= resolution < 0.1
+
+
 def test_sync_wait_next(throttle_obj, profiler):
     """
     Tests the behavior of a Throttle instance using
@@ -108,6 +270,22 @@ def test_sync_wait_next(throttle_obj, profiler):
     assert_profiler_results(profiler, throttle_obj)
 
 
+def test_sync_wait_next_spin():
+    """
+    Tests the behavior of a Throttle instance using
+    :func:`Throttle.wait_next` with a spin threshold longer than the
+    interval, so it busy-waits all the time.
+    """
+    rate = 1000
+    throttle_obj = Throttle(interval=(1 / rate), spin_threshold=0.002)
+
+    with Profiler(rate, target_rate=rate) as profiler:
+        for _ in range(profiler.iter_count):
+            throttle_obj.wait_next()
+
+    assert_profiler_results(profiler, throttle_obj)
+
+
 def test_sync_loop_no_arguments(throttle_obj, profiler):
     """
     Tests the behavior of a Throttle instance using :func:`Throttle.loop`
@@ -156,6 +334,33 @@ def test_sync_loop_duration(throttle_obj, profiler):
     assert i == profiler.iter_count - 1
 
 
+def test_loop_duration_ticks():
+    """
+    Tests the number of ticks calculated from the `duration` argument of
+    :func:`Throttle.loop`, which must not be affected by floating-point
+    rounding errors.
+    """
+    assert Throttle(0.01)._check_loop_params(0.07, None) == 7
+    assert Throttle(1 / 30)._check_loop_params(0.1, None) == 3
+    assert Throttle(0.1)._check_loop_params(0.25, None) == 3
+    assert Throttle(0.1)._check_loop_params(0.3, None) == 3
+
+
+def test_invalid_interval():
+    """
+    Tests that a :class:`Throttle` cannot have an interval shorter than one
+    nanosecond.
+    """
+    for interval in (0, -1, 1e-10):
+        with pytest.raises(ValueError):
+            Throttle(interval)
+
+    throttle_obj = Throttle(0.01)
+    with pytest.raises(ValueError):
+        throttle_obj.interval = 0
+    assert throttle_obj.interval == 0.01
+
+
 def test_sync_loop_invalid_params(throttle_obj, profiler):
     """
     Tests the behavior of a Throttle instance using
@@ -168,6 +373,7 @@ def test_sync_loop_invalid_params(throttle_obj, profiler):
             next(gen)
 
 
+@pytest.mark.slow
 def test_restart(throttle_obj, profiler):
     """
     Tests the behavior of a single Throttle instance iterating during two
@@ -197,6 +403,25 @@ def test_restart(throttle_obj, profiler):
     assert i == profiler.iter_count - 1
 
 
+def test_restart_while_looping():
+    """
+    Tests that a Throttle instance restarted from inside
+    :func:`Throttle.loop` sets a new time reference and keeps looping.
+    """
+    throttle_obj = Throttle(interval=0.01)
+
+    with Profiler() as profiler:
+        for i in throttle_obj.loop(max_ticks=20):
+            if i == 9:
+                time.sleep(0.1)
+                throttle_obj.restart()
+
+    assert i == 19
+    assert throttle_obj.ticks == 10
+    assert abs(profiler.elapsed_error(0.3)) < 0.01
+
+
+@pytest.mark.slow
 def test_no_restart(throttle_obj, profiler):
     """
     Tests the behavior of a single Throttle instance iterating during two
@@ -205,7 +430,7 @@ def test_no_restart(throttle_obj, profiler):
     be shorter as the Throttle tries to reach its internal rate, and
     therefore the metrics in this period should be different.
     """
-    rest_time = 1
+    rest_time = TESTS_DURATION / 10
     ticks = -1
 
     with profiler:
@@ -254,21 +479,60 @@ async def test_async_await_next_tasks(throttle_obj, profiler):
     :func:`Throttle.await_next` to wait between intervals.
     For each interval, an asynchronous task is created.
     """
+    # Split async tasks in chunks to avoid large number of tasks in the loop
+    # (which reduce performace for high rates and distorts the test).
+    # Coroutines are created before profiling, so only the waits are timed
+    max_tasks = 100
+    batches = [[throttle_obj.await_next()
+                for _ in range(min(max_tasks, profiler.iter_count - i))]
+               for i in range(0, profiler.iter_count, max_tasks)]
 
-    async def aux_task(m: Throttle):
-        await m.await_next()
+    try:
+        with profiler:
+            for batch in batches:
+                await asyncio.gather(*batch)
+    finally:
+        # Coroutines left unawaited if the test fails are closed, so they
+        # do not trigger "never awaited" warnings
+        for batch in batches:
+            for coro in batch:
+                coro.close()
 
-    # Split async tasks in chunks to avoid large number of tasks in the loop
-    # (which reduce performace for high rates and distorts the test)
+    assert_profiler_results(profiler, throttle_obj)
+
+
+@pytest.mark.asyncio
+async def test_async_await_next_spin():
+    """
+    Tests the behavior of a Throttle instance using
+    :func:`Throttle.await_next` with a spin threshold, so the end of each
+    interval is waited yielding to the event loop.
+    """
+    rate = 1000
+    throttle_obj = Throttle(interval=(1 / rate), spin_threshold=0.0005)
+
+    with Profiler(rate, target_rate=rate) as profiler:
+        for _ in range(profiler.iter_count):
+            await throttle_obj.await_next()
+
+    assert_profiler_results(profiler, throttle_obj)
+
+
+@pytest.mark.asyncio
+async def test_async_await_next_batch(throttle_obj, profiler):
+    """
+    Tests the behavior of a Throttle instance using
+    :func:`Throttle.await_next_batch` to wait between intervals in
+    batches from a single task.
+    """
     remaining = profiler.iter_count
-    max_tasks = 100
+    batch_size = 100
 
     with profiler:
         while remaining > 0:
-            size = remaining if remaining < max_tasks else max_tasks
+            size = min(remaining, batch_size)
             remaining -= size
-            await asyncio.gather(*(aux_task(throttle_obj)
-                                   for _ in range(size)))
+            await throttle_obj.await_next_batch(size)
 
     assert_profiler_results(profiler, throttle_obj)
 
@@ -337,7 +601,7 @@ async def test_async_loop_invalid_params(throttle_obj, profiler):
             await gen.__anext__()
 
 
-def test_sync_decorator():
+def test_sync_decorator(fake_clock):
     """
     Tests the :func:`throttle` decorator over a synchronous function
     with `on_fail` parameter.
@@ -358,12 +622,74 @@ def test_sync_decorator():
             call_counter += 1
         else:
             fail_counter += 1
-        time.sleep(0.1)
+        fake_clock(0.1)
 
     assert call_counter == 13
     assert fail_counter == 10
 
 
+def test_sync_decorator_threads():
+    """
+    Tests the :func:`throttle` decorator over a synchronous function
+    called concurrently from several threads.
+    """
+    results = []
+
+    @throttle(limit=50, interval=10)
+    def func():
+        time.sleep(0.001)
+        return "OK"
+
+    def call_func():
+        for _ in range(25):
+            results.append(func())
+
+    threads = [threading.Thread(target=call_func) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count("OK") == 50
+    assert results.count(None) == 150
+
+
+def test_sync_decorator_key():
+    """
+    Tests the :func:`throttle` decorator over a synchronous function
+    with a `key` function, so each key has its own call limit.
+    """
+    results = {"alice": [], "bob": []}
+
+    @throttle(limit=3, interval=10, on_fail="FAIL", key=lambda user: user)
+    def func(user):
+        return "OK"
+
+    for _ in range(5):
+        for user, user_results in results.items():
+            user_results.append(func(user))
+
+    for user_results in results.values():
+        assert user_results == ["OK"] * 3 + ["FAIL"] * 2
+
+
+def test_decorator_limiters_pruning(fake_clock):
+    """
+    Tests that the limiters kept for the `key` parameter of the decorators
+    are dropped once their interval has elapsed.
+    """
+    limiters = _CallLimiters(interval=1)
+
+    for k in range(100):
+        limiters.add(k).throttle.elapsed()
+    fake_clock(1)
+    for k in range(100, 200):
+        limiters.add(k).throttle.elapsed()
+
+    assert len(limiters) == 100
+    assert min(limiters) == 100
+
+
 def test_sync_decorator_wait():
     """
     Tests the :func:`throttle` decorator over a synchronous function
@@ -385,8 +711,36 @@ def test_sync_decorator_wait():
     assert abs(profiler.elapsed_error(2.0)) < 0.001
 
 
+def test_sync_decorator_wait_threads():
+    """
+    Tests the :func:`throttle` decorator over a synchronous function
+    with `wait` parameter equal to True, called concurrently from several
+    threads.
+    """
+    results = []
+
+    @throttle(limit=5, interval=0.1, wait=True)
+    def func():
+        return "OK"
+
+    def call_func():
+        for _ in range(10):
+            results.append(func())
+
+    threads = [threading.Thread(target=call_func) for _ in range(4)]
+    with Profiler() as profiler:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # 40 calls with 5 calls per interval must span at least 7 intervals
+    assert results.count("OK") == 40
+    assert profiler.elapsed >= 0.7
+
+
 @pytest.mark.asyncio
-async def test_async_decorator_sync_error():
+async def test_async_decorator_sync_error(fake_clock):
     """
     Tests the :func:`athrottle` decorator over a synchronous function
     with a synchronous funcion as `on_fail` parameter.
@@ -401,11 +755,12 @@ async def test_async_decorator_sync_error():
     def func():
         return "OK"
 
-    await assert_async_decorator_error(call_counter, fail_counter, func)
+    await assert_async_decorator_error(call_counter, fail_counter, func,
+                                       fake_clock)
 
 
 @pytest.mark.asyncio
-async def test_async_decorator_async_error():
+async def test_async_decorator_async_error(fake_clock):
     """
     Tests the :func:`athrottle` decorator over an asynchronous function
     with an asynchronous function as `on_fail` parameter.
@@ -420,10 +775,12 @@ async def test_async_decorator_async_error():
     async def func():
         return "OK"
 
-    await assert_async_decorator_error(call_counter, fail_counter, func)
+    await assert_async_decorator_error(call_counter, fail_counter, func,
+                                       fake_clock)
 
 
-async def assert_async_decorator_error(call_counter, fail_counter, func):
+async def assert_async_decorator_error(call_counter, fail_counter, func,
+                                       fake_clock):
     """
     Helper function for :func:`test_async_decorator_sync_error`
     and :func:`test_async_decorator_async_error`.
@@ -434,14 +791,14 @@ async def assert_async_decorator_error(call_counter, fail_counter, func):
             call_counter += 1
         else:
             fail_counter += 1
-        time.sleep(0.1)
+        fake_clock(0.1)
 
     assert call_counter == 13
     assert fail_counter == 10
 
 
 @pytest.mark.asyncio
-async def test_async_decorator_value_error():
+async def test_async_decorator_value_error(fake_clock):
     """
     Tests the :func:`athrottle` decorator over an asynchronous function
     with a non-function value as `on_fail` parameter.
@@ -459,12 +816,33 @@ async def test_async_decorator_value_error():
             call_counter += 1
         elif result == 7:
             fail_counter += 1
-        time.sleep(0.1)
+        fake_clock(0.1)
 
     assert call_counter == 13
     assert fail_counter == 10
 
 
+@pytest.mark.asyncio
+async def test_async_decorator_key():
+    """
+    Tests the :func:`athrottle` decorator over an asynchronous function
+    with a `key` function, so each key has its own call limit.
+    """
+    results = {"alice": [], "bob": []}
+
+    @athrottle(limit=3, interval=10, on_fail="FAIL",
+               key=lambda user: user)
+    async def func(user):
+        return "OK"
+
+    for _ in range(5):
+        for user, user_results in results.items():
+            user_results.append(await func(user))
+
+    for user_results in results.values():
+        assert user_results == ["OK"] * 3 + ["FAIL"] * 2
+
+
 @pytest.mark.asyncio
 async def test_async_decorator_wait():
     """
@@ -487,6 +865,24 @@ async def test_async_decorator_wait():
     assert abs(profiler.elapsed_error(2.0)) < 0.001
 
 
+@pytest.mark.asyncio
+async def test_async_decorator_wait_concurrent():
+    """
+    Tests the :func:`athrottle` decorator over an asynchronous function
+    with `wait` parameter equal to True, awaited concurrently.
+    """
+    @athrottle(limit=5, interval=0.1, wait=True)
+    async def func():
+        return "OK"
+
+    with Profiler() as profiler:
+        results = await asyncio.gather(*[func() for _ in range(20)])
+
+    # 20 calls with 5 calls per interval span 3 intervals after the first
+    assert results.count("OK") == 20
+    assert abs(profiler.elapsed_error(0.3)) < 0.1
+
+
 def test_nested_sync_decorators():
     """
     Tests nesting of two :func:`throttle` decorators to set two call
@@ -1,9 +1,156 @@
 import asyncio
 import inspect
-import math
+import sys
+import warnings
 from functools import wraps
+from itertools import count
+from threading import Lock
 from time import perf_counter, sleep
 
+try:
+    from time import perf_counter_ns
+except ImportError:  # Python < 3.7
+    def perf_counter_ns():
+        return int(perf_counter() * 1e9)
+
+if sys.platform == 'win32' and sys.version_info < (3, 11):
+    # Before Python 3.11, sleep() on Windows is bound to the system timer
+    # period (15.6 ms by default), which is raised only while sleeping
+    import ctypes
+    _winmm = ctypes.WinDLL('winmm')
+else:
+    _winmm = None
+
+# asyncio.get_running_loop() is not available before Python 3.7
+_get_running_loop = getattr(asyncio, 'get_running_loop',
+                            asyncio.get_event_loop)
+
+
+def _probe_sleep_resolution(samples=20):
+    """
+    Measures how long :func:`~time.sleep` oversleeps when asked to sleep
+    for 1 ms.
+
+    :param samples: Number of sleeps to measure.
+    :return:        90th percentile of the measured oversleeps, in seconds.
+    """
+    if _winmm is not None:
+        _winmm.timeBeginPeriod(1)
+    try:
+        delays = []
+        for _ in range(samples):
+            t_start = perf_counter()
+            sleep(0.001)
+            delays.append(perf_counter() - t_start - 0.001)
+    finally:
+        if _winmm is not None:
+            _winmm.timeEndPeriod(1)
+
+    delays.sort()
+    return max(delays[(samples * 9) // 10], 0.0)
+
+
+#: Default seconds before a deadline in which waiting functions stop
+#: sleeping and busy-wait instead. Sleeping is accurate enough on Linux,
+#: so it is 0 there. On other platforms, it is None until the first
+#: synchronous wait, which measures it.
+SPIN_THRESHOLD = 0.0 if sys.platform.startswith('linux') else None
+
+# Spin threshold of asynchronous waits while SPIN_THRESHOLD is not measured,
+# since measuring it would block the event loop
+_ASYNC_SPIN_THRESHOLD = 0.002
+
+
+def _default_spin_threshold():
+    """
+    Returns :data:`SPIN_THRESHOLD`, measuring it first if needed.
+    """
+    global SPIN_THRESHOLD
+    if SPIN_THRESHOLD is None:
+        SPIN_THRESHOLD = _probe_sleep_resolution()
+    return SPIN_THRESHOLD
+
+
+def _os_sleep(seconds):
+    """
+    Calls :func:`~time.sleep`, raising the Windows timer period only for
+    the duration of the call where it is needed.
+    """
+    if _winmm is None:
+        sleep(seconds)
+        return
+    _winmm.timeBeginPeriod(1)
+    try:
+        sleep(seconds)
+    finally:
+        _winmm.timeEndPeriod(1)
+
+
+def precise_sleep(deadline, spin_threshold=None, _pc=perf_counter):
+    """
+    Blocks until `deadline`, a time reference of
+    :func:`~time.perf_counter`. It sleeps until `spin_threshold` seconds
+    before the deadline and then busy-waits for the remaining time, so it
+    does not oversleep on platforms where :func:`~time.sleep` is coarse.
+
+    :param deadline:       :func:`~time.perf_counter` value to wait for.
+    :param spin_threshold: Seconds of busy-waiting before the deadline.
+                           If not set, :data:`SPIN_THRESHOLD` is used.
+    """
+    if spin_threshold is None:
+        # Resolved first, so a measurement does not delay the wait
+        spin_threshold = _default_spin_threshold()
+    remaining = deadline - _pc()
+    if remaining <= 0:
+        return
+    if remaining > spin_threshold:
+        _os_sleep(remaining - spin_threshold)
+    while _pc() < deadline:
+        pass
+
+
+async def _await_deadline(deadline, spin_threshold=None,
+                          _pc=perf_counter_ns):
+    """
+    Waits asynchronously until `deadline`, a time reference of
+    :func:`perf_counter_ns`. The last `spin_threshold` seconds are waited
+    by repeatedly yielding control to the event loop. If the deadline has
+    already passed, it only yields control once.
+    """
+    if spin_threshold is None:
+        spin_threshold = SPIN_THRESHOLD
+        if spin_threshold is None:
+            spin_threshold = _ASYNC_SPIN_THRESHOLD
+    sleep_time = (deadline - _pc()) / 1e9 - spin_threshold
+    if sleep_time <= -spin_threshold:
+        await asyncio.sleep(0)
+        return
+
+    if sleep_time > 0:
+        loop = _get_running_loop()
+        # Schedule the wake-up at an absolute time of the event loop clock
+        # instead of going through asyncio.sleep(). Timers can fire up to
+        # one clock resolution early, so the wait is repeated until the
+        # target time is actually reached.
+        if _winmm is not None:
+            _winmm.timeBeginPeriod(1)
+        try:
+            while sleep_time > 0:
+                future = loop.create_future()
+                handle = loop.call_at(loop.time() + sleep_time,
+                                      future.set_result, None)
+                try:
+                    await future
+                finally:
+                    handle.cancel()
+                sleep_time = (deadline - _pc()) / 1e9 - spin_threshold
+        finally:
+            if _winmm is not None:
+                _winmm.timeEndPeriod(1)
+
+    while _pc() < deadline:
+        await asyncio.sleep(0)
+
 
 class Throttle:
     """
@@ -28,36 +175,74 @@ class Throttle:
     iters: 24, total_time: 1.0
     """
 
-    def __init__(self, interval):
+    # The decorators create one instance per key, so no __dict__ is kept
+    __slots__ = ('_interval_ns', '_t_start', 'ticks', '_interval',
+                 'spin_threshold', '__weakref__')
+
+    def __init__(self, interval, spin_threshold=None):
         """
         Returns a :class:`Throttle` instance. Time reference will be set the
         first time a timing function is called.
 
-        :param interval: Interval value for timing functions, in seconds.
+        :param interval:       Interval value for timing functions, in
+                               seconds.
+        :param spin_threshold: Seconds before the end of each interval in
+                               which waiting functions stop sleeping and
+                               busy-wait instead (see :func:`precise_sleep`).
+                               If not set, :data:`SPIN_THRESHOLD` is used.
         """
         self.interval = interval
-        self.t_start = None
-        self.ticks = 0
+        self.spin_threshold = spin_threshold
         self.restart()
 
+    @property
+    def interval(self):
+        """
+        Interval value for timing functions, in seconds. Time references
+        are internally kept as integer nanoseconds, so the interval is
+        rounded to the nearest nanosecond and must be at least 1 nanosecond.
+        """
+        return self._interval
+
+    @interval.setter
+    def interval(self, value):
+        interval_ns = round(value * 1e9)
+        if interval_ns < 1:
+            raise ValueError("interval must be at least 1 nanosecond")
+        self._interval = value
+        self._interval_ns = interval_ns
+
+    @property
+    def t_start(self):
+        """
+        Time reference of the current interval, as a value of
+        :func:`time.perf_counter` in seconds, or None if not set yet. It is
+        internally kept as integer nanoseconds.
+        """
+        return None if self._t_start is None else self._t_start / 1e9
+
+    @t_start.setter
+    def t_start(self, value):
+        self._t_start = None if value is None else round(value * 1e9)
+
     def _check(self):
         """
         Get the interval value for timing functions and initialize the time
         reference if not set yet.
         """
-        if self.t_start is None:
-            self.restart()
-            self.t_start = perf_counter()
+        if self._t_start is None:
+            self._t_start = perf_counter_ns()
+            self.ticks = 0
 
     def restart(self):
         """
         Reset the instance deleting its time reference, which will be set the
         next time a timing function is called.
         """
-        self.t_start = None
+        self._t_start = None
         self.ticks = 0
 
-    def elapsed(self, auto_reset=True, exact=True):
+    def elapsed(self, auto_reset=True, exact=True, _pc=perf_counter_ns):
         """
         Checks if the interval has elapsed.
 
@@ -71,45 +256,94 @@ class Throttle:
                            `exact` has no effect if `auto_reset` is False.
         :return:           True if the interval has elapsed, otherwise False.
         """
-        self._check()
-        ret = (perf_counter() - self.t_start >= self.interval)
-        if ret and auto_reset:
+        now = _pc()
+        if self._t_start is None:
+            self._t_start = now
+            self.ticks = 0
+        if now - self._t_start < self._interval_ns:
+            return False
+
+        if auto_reset:
             self.ticks += 1
             if exact:
-                self.t_start += self.interval
+                self._t_start += self._interval_ns
             else:
-                self.t_start = perf_counter()
-        return ret
+                self._t_start = now
+        return True
+
+    def elapsed_many(self, auto_reset=True, _pc=perf_counter_ns):
+        """
+        Checks how many whole intervals have elapsed. Unlike
+        :func:`elapsed`, all the intervals missed (e.g. after a long pause)
+        are counted at once.
 
-    def wait_next(self):
+        :param auto_reset: If True, the time reference will be increased
+                           with the elapsed intervals.
+        :return:           Number of intervals elapsed.
+        """
+        now = _pc()
+        if self._t_start is None:
+            self._t_start = now
+            self.ticks = 0
+        n = (now - self._t_start) // self._interval_ns
+
+        if n and auto_reset:
+            self.ticks += n
+            self._t_start += n * self._interval_ns
+        return n
+
+    def wait_next(self, _sleep=precise_sleep):
         """
         Blocks until the end of the current interval.
         Note that this function can return immediately if the next interval
         to wait has already elapsed. This happens when reusing a
         :class:`Throttle` instance without calling :func:`restart` first.
         """
-        self._check()
-        t_target = (self.t_start + self.interval)
-        self.t_start += self.interval
-        sleep_time = t_target - perf_counter()
-        if sleep_time > 0:
-            sleep(sleep_time)
+        if self._t_start is None:
+            self._check()
+        t_target = (self._t_start + self._interval_ns)
+        self._t_start = t_target
+        _sleep(t_target / 1e9, self.spin_threshold)
         self.ticks += 1
 
-    async def await_next(self):
+    async def await_next(self, _pc=perf_counter_ns):
         """
         Waits asynchronously until the end of the current interval.
         Note that this function can return immediately if the next interval
         to wait has already elapsed. This happens when reusing a
         :class:`Throttle` instance without calling :func:`restart` first.
         """
-        self._check()
-        t_target = (self.t_start + self.interval)
-        self.t_start += self.interval
-        await asyncio.sleep(t_target - perf_counter())
+        if self._t_start is None:
+            self._check()
+        t_target = (self._t_start + self._interval_ns)
+        self._t_start = t_target
+        if t_target <= _pc():
+            # Already behind: yield once without creating another coroutine
+            await asyncio.sleep(0)
+        else:
+            await _await_deadline(t_target, self.spin_threshold)
         self.ticks += 1
 
-    def loop(self, max_ticks=None, duration=None):
+    async def await_next_batch(self, n, _pc=perf_counter_ns):
+        """
+        Waits asynchronously until the end of each of the next `n`
+        intervals, one after another. This is equivalent to awaiting
+        :func:`await_next` `n` times, but without creating a task for
+        each interval.
+
+        :param n: Number of intervals to wait for.
+        """
+        self._check()
+        for _ in range(n):
+            t_target = (self._t_start + self._interval_ns)
+            self._t_start = t_target
+            if t_target <= _pc():
+                await asyncio.sleep(0)
+            else:
+                await _await_deadline(t_target, self.spin_threshold)
+            self.ticks += 1
+
+    def loop(self, max_ticks=None, duration=None, _sleep=precise_sleep):
         """
         Returns a synchronous generator yielding every time an interval has
         elapsed.
@@ -128,14 +362,19 @@ class Throttle:
                           function was called.
         """
         max_ticks = self._check_loop_params(duration, max_ticks)
-        ticks = 0
 
-        while max_ticks is None or ticks < max_ticks:
-            self.wait_next()
+        # wait_next() is inlined to save a method call on every tick
+        for ticks in count() if max_ticks is None else range(max_ticks):
+            if self._t_start is None:
+                self._check()   # restart() was called while looping
+            t_target = self._t_start + self._interval_ns
+            self._t_start = t_target
+            _sleep(t_target / 1e9, self.spin_threshold)
+            self.ticks += 1
             yield ticks
-            ticks += 1
 
-    async def aloop(self, max_ticks=None, duration=None):
+    async def aloop(self, max_ticks=None, duration=None,
+                    _pc=perf_counter_ns):
         """
         Returns an asynchronous generator yielding every time an interval has
         elapsed.
@@ -154,12 +393,19 @@ class Throttle:
                           function was called.
         """
         max_ticks = self._check_loop_params(duration, max_ticks)
-        ticks = 0
 
-        while max_ticks is None or ticks < max_ticks:
-            await self.await_next()
+        # await_next() is inlined to save a coroutine on every tick
+        for ticks in count() if max_ticks is None else range(max_ticks):
+            if self._t_start is None:
+                self._check()   # restart() was called while looping
+            t_target = self._t_start + self._interval_ns
+            self._t_start = t_target
+            if t_target <= _pc():
+                await asyncio.sleep(0)
+            else:
+                await _await_deadline(t_target, self.spin_threshold)
+            self.ticks += 1
             yield ticks
-            ticks += 1
 
     def _check_loop_params(self, duration, max_ticks):
         """
@@ -171,12 +417,63 @@ class Throttle:
         self._check()
 
         if duration is not None:
-            max_ticks = math.ceil(duration / self.interval)
+            # Ceiling division over integer nanoseconds. The remainder is
+            # ignored if it may come from rounding the interval to
+            # nanoseconds (up to 0.5 ns per tick)
+            max_ticks, remainder = divmod(round(duration * 1e9),
+                                          self._interval_ns)
+            if 2 * remainder > max_ticks:
+                max_ticks += 1
 
         return max_ticks
 
 
-def throttle(limit=1, interval=1.0, wait=False, on_fail=None):
+class _CallLimiter:
+    """
+    Internal class. Keeps the number of calls made in the current interval
+    for the :func:`throttle` and :func:`athrottle` decorators.
+    """
+    __slots__ = ('calls', 'throttle')
+
+    def __init__(self, interval):
+        self.calls = 0
+        self.throttle = Throttle(interval)
+
+
+class _CallLimiters(dict):
+    """
+    Internal class. Maps each key of the :func:`throttle` and
+    :func:`athrottle` decorators to its :class:`_CallLimiter`. Limiters
+    whose interval has elapsed are dropped as new keys are added, since a
+    new limiter would behave the same, so only the keys called in the last
+    interval are kept.
+    """
+    __slots__ = ('interval', '_prune_at')
+
+    # Number of keys from which idle limiters start to be dropped
+    MIN_PRUNE_SIZE = 64
+
+    def __init__(self, interval):
+        super().__init__()
+        self.interval = interval
+        self._prune_at = self.MIN_PRUNE_SIZE
+
+    def add(self, key):
+        """
+        Creates and returns the limiter of a new key.
+        """
+        if len(self) >= self._prune_at:
+            for k in [k for k, limiter in self.items()
+                      if limiter.throttle.elapsed(auto_reset=False)]:
+                del self[k]
+            # The threshold grows with the active keys, so the cost of
+            # pruning is amortized over the keys added
+            self._prune_at = max(self.MIN_PRUNE_SIZE, 2 * len(self))
+        limiter = self[key] = _CallLimiter(self.interval)
+        return limiter
+
+
+def throttle(limit=1, interval=1.0, wait=False, on_fail=None, key=None):
     """
     Decorator to limit the number of calls to a synchronous function in
     an interval of time. It ensures that the decorated function is not
@@ -196,28 +493,52 @@ def throttle(limit=1, interval=1.0, wait=False, on_fail=None):
                      decorator will return the result of the call to
                      this function. Note that `on_fail` only makes sense
                      if `wait` is False.
+    :param key:      Function called with the arguments of each call to
+                     get a hashable key (e.g. a user name). If set, the
+                     call limit is applied separately to each key. The
+                     state of a key is dropped once its interval has
+                     elapsed, so only the keys called in the last interval
+                     are kept in memory.
     :return:         Result of the call to the decorated function, or
                      `on_fail` if limit is reached (and `wait` is False).
     """
-    call_counter = 0
-    throttle_ = Throttle(interval)
+    limiters = _CallLimiters(interval)
+    lock = Lock()
+    fail_is_callable = callable(on_fail)
 
     def decorator(func):
 
         @wraps(func)
         def wrapper(*args, **kwargs):
-            nonlocal call_counter
-            call_counter += 1
-
-            if throttle_.elapsed():
-                call_counter = 1
-            elif call_counter > limit:
-                if wait:
-                    throttle_.wait_next()
-                    call_counter = 1
-                else:
-                    return on_fail() if callable(on_fail) else on_fail
-
+            k = None if key is None else key(*args, **kwargs)
+
+            # The counters are shared by all the threads calling the
+            # function. The lock also covers the lookup, so a limiter is not
+            # dropped by another thread while it is being updated
+            with lock:
+                limiter = limiters.get(k)
+                if limiter is None:
+                    limiter = limiters.add(k)
+                limiter.calls += 1
+
+                thr = limiter.throttle
+                if thr.elapsed():
+                    limiter.calls = 1
+                elif limiter.calls > limit and wait:
+                    # The next interval is reserved here and waited for
+                    # after releasing the lock, so other threads are not
+                    # blocked while this one sleeps
+                    thr._t_start += thr._interval_ns
+                    thr.ticks += 1
+                    limiter.calls = 1
+                limit_reached = limiter.calls > limit
+                t_start = thr._t_start
+
+            if limit_reached:
+                return on_fail() if fail_is_callable else on_fail
+            if wait:
+                # Calls counted in a reserved interval wait for it to start
+                precise_sleep(t_start / 1e9, thr.spin_threshold)
             return func(*args, **kwargs)
 
         return wrapper
@@ -225,7 +546,7 @@ def throttle(limit=1, interval=1.0, wait=False, on_fail=None):
     return decorator
 
 
-def athrottle(limit=1, interval=1.0, wait=False, on_fail=None):
+def athrottle(limit=1, interval=1.0, wait=False, on_fail=None, key=None):
     """
     Decorator to limit the number of calls to a synchronous or asynchronous
     function in an interval of time. It ensures that the decorated function
@@ -247,34 +568,56 @@ def athrottle(limit=1, interval=1.0, wait=False, on_fail=None):
                      this function (if this function is asynchronous,
                      it will await for its result). Note that `on_fail`
                      only makes sense if `wait` is False.
+    :param key:      Function called with the arguments of each call to
+                     get a hashable key (e.g. a user name). If set, the
+                     call limit is applied separately to each key. The
+                     state of a key is dropped once its interval has
+                     elapsed, so only the keys called in the last interval
+                     are kept in memory.
     :return:         Result of the call to the decorated function, or
                      `on_fail` if limit is reached (and `wait` is False).
     """
-    call_counter = 0
-    throttle_ = Throttle(interval)
+    limiters = _CallLimiters(interval)
+    # Function types are checked once here instead of on every call
+    fail_is_async = inspect.iscoroutinefunction(on_fail)
+    fail_is_function = inspect.isfunction(on_fail)
 
     def decorator(func):
+        func_is_async = inspect.iscoroutinefunction(func)
 
         @wraps(func)
         async def awrapper(*args, **kwargs):
-            nonlocal call_counter
-            call_counter += 1
-
-            if throttle_.elapsed():
-                call_counter = 1
-            elif call_counter > limit:
+            k = None if key is None else key(*args, **kwargs)
+            limiter = limiters.get(k)
+            if limiter is None:
+                limiter = limiters.add(k)
+            limiter.calls += 1
+
+            thr = limiter.throttle
+            if thr.elapsed():
+                limiter.calls = 1
+            elif limiter.calls > limit:
                 if wait:
-                    await throttle_.await_next()
-                    call_counter = 1
+                    # The next interval is reserved before awaiting, like in
+                    # throttle(), so calls arriving meanwhile are counted in
+                    # it instead of reserving another one each
+                    thr._t_start += thr._interval_ns
+                    thr.ticks += 1
+                    limiter.calls = 1
                 else:
-                    if inspect.iscoroutinefunction(on_fail):
+                    if fail_is_async:
                         return await on_fail()
-                    elif inspect.isfunction(on_fail):
+                    elif fail_is_function:
                         return on_fail()
                     else:
                         return on_fail
 
-            if inspect.iscoroutinefunction(func):
+            t_start = thr._t_start
+            if wait and t_start > perf_counter_ns():
+                # Calls counted in a reserved interval wait for it to start
+                await _await_deadline(t_start, thr.spin_threshold)
+
+            if func_is_async:
                 return await func(*args, **kwargs)
             else:
                 return func(*args, **kwargs)
@@ -282,3 +625,32 @@ def athrottle(limit=1, interval=1.0, wait=False, on_fail=None):
         return awrapper
 
     return decorator
+
+
+def install_fast_loop():
+    """
+    Sets `uvloop <https://github.com/MagicStack/uvloop>`_ as the event loop
+    policy for asyncio, if it is installed. Its timer implementation
+    reduces the scheduling overhead of :func:`Throttle.await_next` and
+    :func:`Throttle.aloop` at high rates.
+
+    Event loop policies are deprecated since Python 3.12, so this function
+    emits a :class:`DeprecationWarning` there. Run the application with
+    ``uvloop.run(main())`` or
+    ``asyncio.Runner(loop_factory=uvloop.new_event_loop)`` instead.
+
+    :return: True if uvloop has been set as the event loop policy,
+             otherwise False.
+    """
+    if sys.version_info >= (3, 12):
+        warnings.warn("install_fast_loop() is deprecated since Python 3.12, "
+                      "use uvloop.run() or asyncio.Runner(loop_factory="
+                      "uvloop.new_event_loop) instead",
+                      DeprecationWarning, stacklevel=2)
+    try:
+        import uvloop
+    except ImportError:
+        return False
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
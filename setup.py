@@ -32,4 +32,7 @@ setuptools.setup(
         'throttle', 'throttling', 'time', 'timing', 'rate'
     ],
     python_requires='>=3.6',
+    extras_require={
+        'uvloop': ['uvloop'],
+    },
 )